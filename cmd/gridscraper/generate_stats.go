@@ -16,6 +16,7 @@ var (
 	generateStatsService      string
 	generateStatsRate         string
 	generateStatsClearExisting bool
+	generateStatsFullRebuild   bool
 )
 
 var generateStatsCmd = &cobra.Command{
@@ -29,6 +30,7 @@ func init() {
 	generateStatsCmd.Flags().StringVar(&generateStatsService, "service", "nyseg", "Service to generate stats for (nyseg or coned, default: nyseg)")
 	generateStatsCmd.Flags().StringVar(&generateStatsRate, "rate", "", "Optional cost per kWh rate for cost statistics (e.g., 0.20102749)")
 	generateStatsCmd.Flags().BoolVar(&generateStatsClearExisting, "clear-existing", false, "Clear existing statistics before regenerating (use to fix corrupted data)")
+	generateStatsCmd.Flags().BoolVar(&generateStatsFullRebuild, "full-rebuild", false, "Regenerate every hour instead of only those changed since the last run, keeping existing statistics")
 	rootCmd.AddCommand(generateStatsCmd)
 }
 
@@ -67,6 +69,7 @@ func runGenerateStats(cmd *cobra.Command, args []string) error {
 	payload := map[string]interface{}{
 		"entity_id":      haConfig.EntityID,
 		"clear_existing": generateStatsClearExisting,
+		"full_rebuild":   generateStatsFullRebuild,
 	}
 
 	body, err := json.Marshal(payload)
@@ -128,6 +131,7 @@ func runGenerateStats(cmd *cobra.Command, args []string) error {
 		"energy_entity_id": haConfig.EntityID,
 		"cost_entity_id":   costEntityID,
 		"clear_existing":   generateStatsClearExisting,
+		"full_rebuild":     generateStatsFullRebuild,
 	}
 
 	// Add rate if provided via flag or config
@@ -10,6 +10,9 @@ import (
 	"github.com/spf13/cobra"
 )
 
+// publishBatchSize is the number of records sent per backfill_state request
+const publishBatchSize = 500
+
 var (
 	publishService string
 	publishSince   string
@@ -155,24 +158,9 @@ func runPublish(cmd *cobra.Command, args []string) error {
 			fmt.Printf("Limiting to %d records (--limit flag)\n", publishLimit)
 		}
 
-		// Publish each record with individual hourly consumption values
+		// Publish records in batches of individual hourly consumption values
 		fmt.Printf("Publishing %d records for %s...\n", len(filteredData), service)
-		published := 0
-		for i, record := range filteredData {
-			fmt.Printf("[%d/%d] Publishing %s (%.2f kWh)... ", i+1, len(filteredData), record.StartTime.Format("2006-01-02 15:04"), record.KWh)
-			if err := pub.Publish(record); err != nil {
-				fmt.Printf("FAILED: %v\n", err)
-				continue
-			}
-
-			// Mark record as published in database
-			if err := db.MarkPublished(record.ID); err != nil {
-				fmt.Printf("✓ (warning: failed to mark as published: %v)\n", err)
-			} else {
-				fmt.Printf("✓\n")
-			}
-			published++
-		}
+		published := publishRecords(pub, db, filteredData)
 
 		fmt.Printf("Successfully published %d/%d records for %s\n", published, len(filteredData), service)
 		totalPublished += published
@@ -182,6 +170,52 @@ func runPublish(cmd *cobra.Command, args []string) error {
 	return nil
 }
 
+// batchPublisher sends a batch of readings to Home Assistant
+type batchPublisher interface {
+	PublishBatch(readings []models.UsageData) error
+}
+
+// publishedMarker records that a reading has been published
+type publishedMarker interface {
+	MarkPublished(id int) error
+}
+
+// publishRecords sends records in batches of publishBatchSize and marks the
+// records of each successful batch as published. A failed batch is reported and
+// skipped, leaving its records unpublished. Returns the number of records published.
+func publishRecords(pub batchPublisher, marker publishedMarker, records []models.UsageData) int {
+	published := 0
+	for start := 0; start < len(records); start += publishBatchSize {
+		end := start + publishBatchSize
+		if end > len(records) {
+			end = len(records)
+		}
+		batch := records[start:end]
+
+		fmt.Printf("[%d-%d/%d] Publishing %s to %s... ", start+1, end, len(records),
+			batch[0].StartTime.Format("2006-01-02 15:04"), batch[len(batch)-1].StartTime.Format("2006-01-02 15:04"))
+		if err := pub.PublishBatch(batch); err != nil {
+			fmt.Printf("FAILED: %v\n", err)
+			continue
+		}
+
+		// Mark records as published in database
+		markFailed := 0
+		for _, record := range batch {
+			if err := marker.MarkPublished(record.ID); err != nil {
+				markFailed++
+			}
+		}
+		if markFailed > 0 {
+			fmt.Printf("✓ (warning: failed to mark %d records as published)\n", markFailed)
+		} else {
+			fmt.Printf("✓\n")
+		}
+		published += len(batch)
+	}
+	return published
+}
+
 // parseDate parses a date string in either YYYY-MM-DD format or relative format (e.g., "7d")
 func parseDate(dateStr string) (time.Time, error) {
 	// Try absolute date format first
@@ -0,0 +1,89 @@
+package main
+
+import (
+	"errors"
+	"testing"
+	"time"
+
+	"github.com/jgoulah/gridscraper/pkg/models"
+)
+
+type fakePublisher struct {
+	batches [][]models.UsageData
+	failOn  int // 1-based index of the batch that fails, 0 for none
+}
+
+func (f *fakePublisher) PublishBatch(readings []models.UsageData) error {
+	f.batches = append(f.batches, readings)
+	if len(f.batches) == f.failOn {
+		return errors.New("simulated failure")
+	}
+	return nil
+}
+
+type fakeMarker struct {
+	marked []int
+}
+
+func (f *fakeMarker) MarkPublished(id int) error {
+	f.marked = append(f.marked, id)
+	return nil
+}
+
+func testRecords(n int) []models.UsageData {
+	records := make([]models.UsageData, n)
+	start := time.Date(2024, 1, 1, 0, 0, 0, 0, time.UTC)
+	for i := range records {
+		records[i] = models.UsageData{ID: i + 1, StartTime: start.Add(time.Duration(i) * time.Hour), KWh: 1}
+	}
+	return records
+}
+
+func TestPublishRecordsSplitsIntoBatches(t *testing.T) {
+	tests := []struct {
+		records   int
+		wantSizes []int
+	}{
+		{records: 0, wantSizes: nil},
+		{records: 1, wantSizes: []int{1}},
+		{records: publishBatchSize, wantSizes: []int{publishBatchSize}},
+		{records: publishBatchSize + 1, wantSizes: []int{publishBatchSize, 1}},
+		{records: 2*publishBatchSize + 3, wantSizes: []int{publishBatchSize, publishBatchSize, 3}},
+	}
+
+	for _, tt := range tests {
+		pub := &fakePublisher{}
+		marker := &fakeMarker{}
+
+		published := publishRecords(pub, marker, testRecords(tt.records))
+
+		if len(pub.batches) != len(tt.wantSizes) {
+			t.Fatalf("%d records: sent %d requests, want %d", tt.records, len(pub.batches), len(tt.wantSizes))
+		}
+		for i, size := range tt.wantSizes {
+			if len(pub.batches[i]) != size {
+				t.Errorf("%d records: batch %d has %d readings, want %d", tt.records, i+1, len(pub.batches[i]), size)
+			}
+		}
+		if published != tt.records || len(marker.marked) != tt.records {
+			t.Errorf("%d records: published %d and marked %d, want all", tt.records, published, len(marker.marked))
+		}
+	}
+}
+
+func TestPublishRecordsLeavesFailedBatchUnpublished(t *testing.T) {
+	pub := &fakePublisher{failOn: 1}
+	marker := &fakeMarker{}
+
+	published := publishRecords(pub, marker, testRecords(publishBatchSize+1))
+
+	if len(pub.batches) != 2 {
+		t.Fatalf("sent %d requests, want 2", len(pub.batches))
+	}
+	if published != 1 {
+		t.Errorf("published = %d, want 1", published)
+	}
+	if len(marker.marked) != 1 || marker.marked[0] != publishBatchSize+1 {
+		t.Errorf("marked = %v, want only the record of the second batch", marker.marked)
+	}
+}
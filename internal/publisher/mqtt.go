@@ -37,23 +37,22 @@ func New(haCfg config.HAConfig) (*Publisher, error) {
 	}, nil
 }
 
-// HAPayload matches the Home Assistant backfill service call data
-type HAPayload struct {
-	EntityID    string `json:"entity_id"`
+// HAPoint is a single reading inside an HABatchPayload
+type HAPoint struct {
 	State       string `json:"state"`
 	LastChanged string `json:"last_changed"`
 	LastUpdated string `json:"last_updated"`
 }
 
-// Publish sends a usage reading to Home Assistant via HTTP API
-func (p *Publisher) Publish(reading models.UsageData) error {
-	if !p.haConfig.Enabled {
-		return fmt.Errorf("Home Assistant publishing is not enabled in config")
-	}
-
-	// Build the full API URL (AppDaemon API endpoint)
-	apiURL := fmt.Sprintf("%s/api/appdaemon/backfill_state", p.haConfig.URL)
+// HABatchPayload matches the AppDaemon backfill_state call data: several
+// readings for one entity in a single request
+type HABatchPayload struct {
+	EntityID string    `json:"entity_id"`
+	Points   []HAPoint `json:"points"`
+}
 
+// newPoint converts a usage reading to the state and timestamps Home Assistant expects
+func newPoint(reading models.UsageData) HAPoint {
 	// Determine timestamp to use for last_changed and last_updated
 	var timestamp string
 	if !reading.StartTime.IsZero() {
@@ -62,13 +61,32 @@ func (p *Publisher) Publish(reading models.UsageData) error {
 		timestamp = reading.Date.Format(time.RFC3339)
 	}
 
-	// Create payload for Home Assistant
-	payload := HAPayload{
-		EntityID:    p.haConfig.EntityID,
+	return HAPoint{
 		State:       fmt.Sprintf("%.2f", reading.KWh),
 		LastChanged: timestamp,
 		LastUpdated: timestamp,
 	}
+}
+
+// PublishBatch sends several usage readings to Home Assistant in one HTTP call.
+// The AppDaemon script inserts them in a single transaction, so either all of
+// them are stored (duplicates are skipped) or the call fails as a whole.
+func (p *Publisher) PublishBatch(readings []models.UsageData) error {
+	if !p.haConfig.Enabled {
+		return fmt.Errorf("Home Assistant publishing is not enabled in config")
+	}
+
+	// Build the full API URL (AppDaemon API endpoint)
+	apiURL := fmt.Sprintf("%s/api/appdaemon/backfill_state", p.haConfig.URL)
+
+	// Create payload for Home Assistant
+	payload := HABatchPayload{
+		EntityID: p.haConfig.EntityID,
+		Points:   make([]HAPoint, 0, len(readings)),
+	}
+	for _, reading := range readings {
+		payload.Points = append(payload.Points, newPoint(reading))
+	}
 
 	// Marshal to JSON
 	body, err := json.Marshal(payload)
@@ -77,7 +95,7 @@ func (p *Publisher) Publish(reading models.UsageData) error {
 	}
 
 	// Create HTTP request
-	client := &http.Client{Timeout: 10 * time.Second}
+	client := &http.Client{Timeout: 60 * time.Second}
 	req, err := http.NewRequest("POST", apiURL, bytes.NewBuffer(body))
 	if err != nil {
 		return fmt.Errorf("creating request: %w", err)
@@ -101,4 +119,3 @@ func (p *Publisher) Publish(reading models.UsageData) error {
 
 	return nil
 }
-
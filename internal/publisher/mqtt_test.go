@@ -0,0 +1,96 @@
+package publisher
+
+import (
+	"encoding/json"
+	"net/http"
+	"net/http/httptest"
+	"testing"
+	"time"
+
+	"github.com/jgoulah/gridscraper/internal/config"
+	"github.com/jgoulah/gridscraper/pkg/models"
+)
+
+func newTestPublisher(t *testing.T, handler http.HandlerFunc) *Publisher {
+	t.Helper()
+	server := httptest.NewServer(handler)
+	t.Cleanup(server.Close)
+
+	pub, err := New(config.HAConfig{
+		Enabled:  true,
+		URL:      server.URL,
+		Token:    "test-token",
+		EntityID: "sensor.energy",
+	})
+	if err != nil {
+		t.Fatalf("creating publisher: %v", err)
+	}
+	return pub
+}
+
+func TestPublishBatchSendsPointsPayload(t *testing.T) {
+	var got HABatchPayload
+	var path, auth string
+	pub := newTestPublisher(t, func(w http.ResponseWriter, r *http.Request) {
+		path = r.URL.Path
+		auth = r.Header.Get("Authorization")
+		if err := json.NewDecoder(r.Body).Decode(&got); err != nil {
+			t.Errorf("decoding request body: %v", err)
+		}
+		w.Write([]byte(`{"status": "success", "inserted": 2, "skipped": 0}`))
+	})
+
+	est := time.FixedZone("EST", -5*3600)
+	readings := []models.UsageData{
+		{StartTime: time.Date(2024, 1, 1, 5, 0, 0, 0, est), KWh: 1.234},
+		// Without a start time the reading's date is used
+		{Date: time.Date(2024, 1, 2, 0, 0, 0, 0, est), KWh: 2},
+	}
+	if err := pub.PublishBatch(readings); err != nil {
+		t.Fatalf("PublishBatch: %v", err)
+	}
+
+	if path != "/api/appdaemon/backfill_state" {
+		t.Errorf("path = %q, want /api/appdaemon/backfill_state", path)
+	}
+	if auth != "Bearer test-token" {
+		t.Errorf("Authorization = %q, want Bearer test-token", auth)
+	}
+	want := HABatchPayload{
+		EntityID: "sensor.energy",
+		Points: []HAPoint{
+			{State: "1.23", LastChanged: "2024-01-01T05:00:00-05:00", LastUpdated: "2024-01-01T05:00:00-05:00"},
+			{State: "2.00", LastChanged: "2024-01-02T00:00:00-05:00", LastUpdated: "2024-01-02T00:00:00-05:00"},
+		},
+	}
+	if got.EntityID != want.EntityID || len(got.Points) != len(want.Points) {
+		t.Fatalf("payload = %+v, want %+v", got, want)
+	}
+	for i := range want.Points {
+		if got.Points[i] != want.Points[i] {
+			t.Errorf("point %d = %+v, want %+v", i, got.Points[i], want.Points[i])
+		}
+	}
+}
+
+func TestPublishBatchReturnsErrorOnHTTPFailure(t *testing.T) {
+	pub := newTestPublisher(t, func(w http.ResponseWriter, r *http.Request) {
+		http.Error(w, `{"error": "Database error"}`, http.StatusInternalServerError)
+	})
+
+	err := pub.PublishBatch([]models.UsageData{{StartTime: time.Now(), KWh: 1}})
+	if err == nil {
+		t.Fatal("PublishBatch succeeded, want an error for a 500 response")
+	}
+}
+
+func TestPublishBatchRequiresEnabledConfig(t *testing.T) {
+	pub, err := New(config.HAConfig{})
+	if err != nil {
+		t.Fatalf("creating publisher: %v", err)
+	}
+
+	if err := pub.PublishBatch([]models.UsageData{{KWh: 1}}); err == nil {
+		t.Fatal("PublishBatch succeeded, want an error when publishing is disabled")
+	}
+}
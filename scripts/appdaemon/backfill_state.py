@@ -1,11 +1,192 @@
 import hassapi as hass
 import sqlite3
-import json
+import math
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from datetime import datetime
 
+try:
+    from ciso8601 import parse_datetime as _parse_datetime
+except ImportError:
+    _parse_datetime = None
+
+DB_PATH = '/homeassistant/home-assistant_v2.db'
+
+# JSON attributes stored with every backfilled state
+STATE_ATTRIBUTES = '{"unit_of_measurement": "kWh"}'
+
+# Seconds an endpoint waits for the database worker before answering 503. Kept
+# below the Go client's 60 second HTTP timeout so it sees the 503.
+DB_TIMEOUT = 50
+
+# Earliest epoch timestamp (2000-01-01T00:00:00Z) accepted from senders
+MIN_EPOCH_TS = 946684800
+
+
+def parse_timestamp(value):
+    """Convert an ISO 8601 timestamp such as 2024-01-01T05:00:00-05:00 to epoch seconds"""
+    if not isinstance(value, str):
+        raise TypeError(f"expected an ISO 8601 string, got {type(value).__name__}")
+    if _parse_datetime is not None:
+        return _parse_datetime(value).timestamp()
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def point_timestamps(point):
+    """Return (last_changed_ts, last_updated_ts) of one reading in epoch seconds
+
+    Senders may pass epoch seconds in last_changed_ts/last_updated_ts, which skips
+    parsing entirely; otherwise the ISO 8601 last_changed/last_updated are parsed.
+    """
+    if point.get("last_changed_ts") is not None:
+        last_changed_ts = float(point["last_changed_ts"])
+        last_updated_ts = float(point.get("last_updated_ts", last_changed_ts))
+        # Also catches milliseconds and other unit mix-ups, which would otherwise be
+        # stored and break every later statistics run
+        latest_ts = time.time() + 86400
+        if not (MIN_EPOCH_TS <= last_changed_ts <= latest_ts and MIN_EPOCH_TS <= last_updated_ts <= latest_ts):
+            raise ValueError("epoch timestamps must be seconds between 2000-01-01 and now")
+        return last_changed_ts, last_updated_ts
+
+    # Publishers send identical last_changed/last_updated values, so those are
+    # only parsed once
+    last_changed = point["last_changed"]
+    last_updated = point.get("last_updated", last_changed)
+    last_changed_ts = parse_timestamp(last_changed)
+    if last_updated == last_changed:
+        return last_changed_ts, last_changed_ts
+    return last_changed_ts, parse_timestamp(last_updated)
+
+
+# A plain decimal number with an optional exponent, the text that SQLite's
+# CAST(state AS REAL) reads in full. float() also takes "1_5", "inf" and
+# non-ASCII digits, which the CAST would read differently or not at all.
+NUMERIC_STATE_RE = re.compile(r'[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?')
+
+
+def is_consumption(state):
+    """True for a positive, finite numeric reading such as "1.23" """
+    if isinstance(state, bool):
+        return False
+    if isinstance(state, str):
+        if not NUMERIC_STATE_RE.fullmatch(state):
+            return False
+    elif not isinstance(state, (int, float)):
+        return False
+    value = float(state)
+    return math.isfinite(value) and value > 0
+
+
+# Insert a state unless the entity already has one at that last_changed_ts. HA's
+# states table has no unique key to lean on (attribute-only updates share a
+# last_changed_ts), so the duplicate check lives in the statement itself.
+# Binds (metadata_id, state, last_changed_ts, last_updated_ts, attributes,
+# metadata_id, last_changed_ts).
+INSERT_STATE_SQL = """
+    INSERT INTO states (
+        metadata_id, state, last_changed_ts, last_updated_ts, attributes
+    )
+    SELECT ?, ?, ?, ?, ?
+    WHERE NOT EXISTS (
+        SELECT 1 FROM states
+        WHERE metadata_id = ?
+        AND last_changed_ts = ?
+    )
+"""
+
+# Upsert one hourly statistics row against HA's unique (metadata_id, start_ts) index.
+# Binds (metadata_id, start_ts, created_ts, state, sum).
+UPSERT_STATISTICS_SQL = """
+    INSERT INTO statistics (metadata_id, start_ts, created_ts, state, sum)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (metadata_id, start_ts) DO UPDATE
+    SET state = excluded.state, sum = excluded.sum
+"""
+
+# Derive hourly cost statistics from energy statistics entirely inside SQLite: each
+# hour's cost is energy * rate and the running total comes from a window sum seeded
+# with the prior cost. SQLite materializes the SELECT before writing, so reading
+# and upserting the same table is safe. The WHERE clause also keeps the upsert's
+# ON CONFLICT from parsing as a join constraint.
+# Binds (cost metadata_id, rate, seed, rate, energy metadata_id, start_ts).
+UPSERT_COST_STATISTICS_SQL = """
+    INSERT INTO statistics (metadata_id, start_ts, created_ts, state, sum)
+    SELECT ?, start_ts, start_ts, state * ?, ? + SUM(state * ?) OVER (ORDER BY start_ts)
+    FROM statistics
+    WHERE metadata_id = ?
+    AND start_ts >= ?
+    AND state IS NOT NULL
+    ON CONFLICT (metadata_id, start_ts) DO UPDATE
+    SET state = excluded.state, sum = excluded.sum
+"""
+
+# Cumulative sum of the last statistics row before a given hour, used to seed the
+# running total. Binds (metadata_id, start_ts).
+PRIOR_SUM_SQL = """
+    SELECT sum FROM statistics
+    WHERE metadata_id = ? AND start_ts < ?
+    ORDER BY start_ts DESC
+    LIMIT 1
+"""
+
+# Valid states of one entity bucketed by hour, from a given timestamp onward.
+# readings keeps only the LATEST reading of each hour (not a sum), so duplicate
+# states never double the consumption. The covering index already yields states
+# in last_changed_ts order, so an hour ends wherever the next reading falls in a
+# different one; comparing with LEAD() finds those rows in one ordered pass
+# instead of sorting every state into per-hour partitions. backfill_state only
+# stores positive readings, but HA's recorder can still write "unavailable" and
+# older rows predate that check, so the CAST guard stays (non-numbers cast to 0).
+# Binds (metadata_id, since_ts).
+HOURLY_STATES_CTE = """
+    WITH ordered_states AS (
+        SELECT
+            CAST(last_changed_ts AS INTEGER) / 3600 * 3600 AS hour_ts,
+            CAST(state AS REAL) AS consumption,
+            LEAD(CAST(last_changed_ts AS INTEGER) / 3600 * 3600)
+                OVER (ORDER BY last_changed_ts) AS next_hour_ts
+        FROM states
+        WHERE metadata_id = ?
+        AND last_changed_ts IS NOT NULL
+        AND CAST(state AS REAL) > 0
+        AND last_changed_ts >= ?
+    ),
+    readings AS (
+        SELECT hour_ts, consumption
+        FROM ordered_states
+        WHERE next_hour_ts IS NULL OR next_hour_ts != hour_ts
+    )
+"""
+
+
 class BackfillState(hass.Hass):
     def initialize(self):
+        # All database work runs on one worker thread that owns a single long-lived
+        # connection. Endpoints validate and parse on AppDaemon's threads, hand the
+        # transaction to the worker and wait for its response, so concurrent calls
+        # queue up instead of contending for the SQLite write lock.
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backfill_db")
+        self._run_db(self._open_db)
+
+        # Where the last successful run of each statistics endpoint stopped, keyed by
+        # statistics metadata_id. Later runs only regenerate from that hour onward; an
+        # empty map (e.g. after an AppDaemon restart) means the next run is a full one.
+        # These maps and the id caches below are only used on the database worker.
+        self._stats_resume = {}
+        self._cost_resume = {}
+        # Earliest energy hour rewritten since the matching cost statistics were built
+        self._stats_rewritten_from = {}
+        # Earliest hour backfilled since statistics were last generated, keyed by
+        # states metadata_id, so older readings are picked up without a full rebuild
+        self._states_backfilled_from = {}
+
+        # entity_id -> states_meta.metadata_id and statistic_id -> statistics_meta.id.
+        # Neither changes once created, so each is looked up at most once per entity.
+        self._meta_cache = {}
+        self._stats_meta_cache = {}
+
         # Register HTTP API endpoints
         self.register_endpoint(self.backfill_state, "backfill_state")
         self.register_endpoint(self.generate_statistics, "generate_statistics")
@@ -15,398 +196,484 @@ class BackfillState(hass.Hass):
         self.log("  - /api/appdaemon/generate_statistics")
         self.log("  - /api/appdaemon/generate_cost_statistics")
 
+    def terminate(self):
+        # initialize may have failed before the executor or connection existed
+        if getattr(self, "_conn", None) is not None:
+            self._run_db(self._conn.close)
+        if getattr(self, "_db_executor", None) is not None:
+            self._db_executor.shutdown()
+
+    def _run_db(self, func, *args):
+        """Run func(*args) on the database worker and return its result"""
+        return self._db_executor.submit(func, *args).result()
+
+    def _run_endpoint(self, func, *args):
+        """Run an endpoint's database work, answering 503 if the worker is busy too long.
+
+        A job still waiting in the queue at the timeout is cancelled; one already
+        running finishes on its own, as the worker can't interrupt it.
+        """
+        future = self._db_executor.submit(func, *args)
+        try:
+            return future.result(timeout=DB_TIMEOUT)
+        except FutureTimeoutError:
+            future.cancel()
+            self.log(f"Database worker busy for over {DB_TIMEOUT}s, rejecting request", level="WARNING")
+            return {"error": "Database busy, try again later"}, 503
+
+    @contextmanager
+    def _write_transaction(self):
+        """Open a write transaction and yield a cursor for it.
+
+        The body must execute COMMIT itself; leaving the block any other way (an
+        early return or an exception) rolls the transaction back. BEGIN IMMEDIATE
+        takes the write lock up front so HA's recorder can't make a read-then-write
+        upgrade fail halfway through with SQLITE_BUSY.
+        """
+        cursor = self._conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+        finally:
+            if self._conn.in_transaction:
+                self._conn.rollback()
+
+    def _open_db(self):
+        # Transactions are managed explicitly (isolation_level=None)
+        self._conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn.execute("PRAGMA cache_size=-65536")
+        # HA only indexes states by (metadata_id, last_updated_ts); without this the
+        # duplicate check in INSERT_STATE_SQL walks every state of the entity. The
+        # trailing state column makes it covering for HOURLY_STATES_CTE, so the
+        # statistics scan never has to visit the table rows.
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS ix_backfill_states_metadata_id_last_changed_ts_state
+            ON states (metadata_id, last_changed_ts, state)
+        """)
+        # One row per hour of the statistics window, filled from HOURLY_STATES_CTE so
+        # _generate_statistics scans states only once per call. It is emptied before
+        # each COMMIT, and a rollback empties it as well.
+        self._conn.execute("""
+            CREATE TEMP TABLE hourly_readings (
+                hour_ts INTEGER PRIMARY KEY,
+                consumption REAL NOT NULL
+            )
+        """)
+
     def backfill_state(self, data, **kwargs):
-        """Handle state backfill API calls - stores individual hourly consumption values"""
+        """Handle state backfill API calls - stores individual hourly consumption values
+
+        Accepts either a single reading (state, last_changed, last_updated) or a
+        "points" list of readings, which are all inserted in one transaction.
+        Timestamps may also be given as epoch seconds in last_changed_ts and
+        last_updated_ts instead of ISO 8601 strings.
+        """
         entity_id = data.get("entity_id")
-        state = data.get("state")
-        last_changed = data.get("last_changed")
-        last_updated = data.get("last_updated", last_changed)
+        points = data.get("points")
+        batch = points is not None
+        if not batch:
+            points = [data]
 
-        if not entity_id or not state or not last_changed:
+        if not entity_id or not isinstance(points, list) or not points:
             self.log("Missing required parameters", level="WARNING")
             return {"error": "Missing required parameters"}, 400
 
+        for point in points:
+            if (not isinstance(point, dict) or not point.get("state")
+                    or (not point.get("last_changed") and point.get("last_changed_ts") is None)):
+                self.log("Missing required parameters", level="WARNING")
+                return {"error": "Missing required parameters"}, 400
+
+        # Parse timestamps before handing off to the database worker. Readings that
+        # aren't positive numbers ("unknown", "0.00", ...) never count towards
+        # statistics, so they are dropped here instead of being stored.
+        readings = []
         try:
-            conn = sqlite3.connect('/homeassistant/home-assistant_v2.db', timeout=30)
-            cursor = conn.cursor()
-
-            last_changed_dt = datetime.fromisoformat(last_changed.replace('Z', '+00:00'))
-            last_updated_dt = datetime.fromisoformat(last_updated.replace('Z', '+00:00'))
-
-            # Get or create metadata_id
-            cursor.execute("""
-                SELECT metadata_id FROM states_meta
-                WHERE entity_id = ?
-            """, (entity_id,))
-
-            row = cursor.fetchone()
-            if row:
-                metadata_id = row[0]
-            else:
-                cursor.execute("""
-                    INSERT INTO states_meta (entity_id)
-                    VALUES (?)
-                """, (entity_id,))
-                metadata_id = cursor.lastrowid
-
-            # Check for duplicates
-            cursor.execute("""
-                SELECT state_id FROM states
-                WHERE metadata_id = ?
-                AND last_changed_ts = ?
-            """, (metadata_id, last_changed_dt.timestamp()))
-
-            if cursor.fetchone():
-                conn.close()
-                return {"status": "skipped", "reason": "duplicate"}, 200
-            else:
-                # Insert new state with unit_of_measurement attribute
-                attributes = json.dumps({"unit_of_measurement": "kWh"})
-                cursor.execute("""
-                    INSERT INTO states (
-                        metadata_id, state, last_changed_ts, last_updated_ts, attributes
-                    )
-                    VALUES (?, ?, ?, ?, ?)
-                """, (
-                    metadata_id,
-                    state,
-                    last_changed_dt.timestamp(),
-                    last_updated_dt.timestamp(),
-                    attributes
-                ))
+            for point in points:
+                if not is_consumption(point["state"]):
+                    continue
+                last_changed_ts, last_updated_ts = point_timestamps(point)
+                readings.append((point["state"], last_changed_ts, last_updated_ts))
+        except (TypeError, ValueError) as e:
+            self.log(f"Invalid timestamp: {str(e)}", level="WARNING")
+            return {"error": f"Invalid timestamp: {str(e)}"}, 400
 
-            conn.commit()
-            conn.close()
+        if not readings:
+            if batch:
+                return {"status": "success", "inserted": 0, "skipped": len(points)}, 200
+            return {"status": "skipped", "reason": "non-numeric"}, 200
 
-            return {"status": "success"}, 200
+        return self._run_endpoint(self._insert_states, entity_id, readings, len(points) if batch else None)
+
+    def _insert_states(self, entity_id, readings, batch_size):
+        """Insert parsed readings for entity_id; runs on the database worker"""
+        try:
+            # Insert every reading in a single write transaction
+            with self._write_transaction() as cursor:
+                metadata_id = self._get_states_metadata_id(cursor, entity_id, create=True)
+
+                # Insert new states with unit_of_measurement attribute, skipping duplicates
+                cursor.executemany(INSERT_STATE_SQL, [
+                    (metadata_id, state, last_changed_ts, last_updated_ts, STATE_ATTRIBUTES, metadata_id, last_changed_ts)
+                    for state, last_changed_ts, last_updated_ts in readings
+                ])
+                inserted = cursor.rowcount
+
+                cursor.execute("COMMIT")
+
+                if inserted:
+                    backfilled_from = int(min(ts for _, ts, _ in readings)) // 3600 * 3600
+                    self._states_backfilled_from[metadata_id] = min(
+                        backfilled_from, self._states_backfilled_from.get(metadata_id, backfilled_from))
+
+                if batch_size is not None:
+                    return {"status": "success", "inserted": inserted, "skipped": batch_size - inserted}, 200
+                if inserted == 0:
+                    return {"status": "skipped", "reason": "duplicate"}, 200
+                return {"status": "success"}, 200
 
         except Exception as e:
+            # A states_meta row created by the rolled back transaction is gone again
+            self._meta_cache.pop(entity_id, None)
             self.log(f"Database error: {str(e)}", level="ERROR")
-            if 'conn' in locals():
-                conn.close()
             return {"error": str(e)}, 500
 
     def generate_statistics(self, data, **kwargs):
-        """Generate statistics from individual hourly consumption values"""
+        """Generate statistics from individual hourly consumption values
+
+        Only hours from the previous run's last hour (or the earliest hour backfilled
+        since then) onward are regenerated unless clear_existing or full_rebuild is set.
+        """
         entity_id = data.get("entity_id")
         clear_existing = data.get("clear_existing", False)
+        full_rebuild = data.get("full_rebuild", False)
 
         if not entity_id:
             return {"error": "entity_id required"}, 400
 
+        return self._run_endpoint(self._generate_statistics, entity_id, clear_existing, full_rebuild)
+
+    def _generate_statistics(self, entity_id, clear_existing, full_rebuild):
+        """Rebuild hourly energy statistics; runs on the database worker"""
         try:
-            conn = sqlite3.connect('/homeassistant/home-assistant_v2.db', timeout=30)
-            cursor = conn.cursor()
-
-            # Get statistics metadata_id
-            cursor.execute("SELECT id FROM statistics_meta WHERE statistic_id = ?", (entity_id,))
-            row = cursor.fetchone()
-            if not row:
-                conn.close()
-                return {"error": "No statistics metadata found"}, 404
-            stats_metadata_id = row[0]
-
-            # Get states metadata_id
-            cursor.execute("SELECT metadata_id FROM states_meta WHERE entity_id = ?", (entity_id,))
-            row = cursor.fetchone()
-            if not row:
-                conn.close()
-                return {"error": "No states found"}, 404
-            states_metadata_id = row[0]
-
-            # Optionally clear existing statistics to ensure clean regeneration
-            if clear_existing:
-                cursor.execute("DELETE FROM statistics WHERE metadata_id = ?", (stats_metadata_id,))
-                cursor.execute("DELETE FROM statistics_short_term WHERE metadata_id = ?", (stats_metadata_id,))
-                self.log(f"Cleared existing statistics for metadata_id {stats_metadata_id}")
-
-            # Get all states in chronological order (individual hourly consumption)
-            # Use MAX to deduplicate - if multiple states exist for same hour, take the latest
-            cursor.execute("""
-                SELECT state, last_changed_ts
-                FROM states
-                WHERE metadata_id = ?
-                AND last_changed_ts IS NOT NULL
-                AND state NOT IN ('unknown', 'unavailable', '0.0', '0')
-                AND CAST(state AS REAL) > 0
-                ORDER BY last_changed_ts
-            """, (states_metadata_id,))
-
-            states = cursor.fetchall()
-
-            if not states:
-                conn.close()
-                return {"error": "No valid states found"}, 404
-
-            # Group by hour - take the LATEST value for each hour (not sum)
-            # This prevents duplicate states from doubling the consumption
-            hourly_data = {}
-
-            for state_str, ts in states:
-                consumption = float(state_str)
-                hour_ts = int(ts // 3600 * 3600)
-                # Overwrite with latest value for this hour (states are ordered by timestamp)
-                hourly_data[hour_ts] = consumption
-
-            # Recalculate cumulative sum starting from where existing statistics left off.
-            # This handles the case where HA has purged old states — without this, the sum
-            # would reset to 0 at the earliest available state, creating a huge negative
-            # delta in the Energy dashboard at the state retention boundary.
-            inserted = 0
-            updated = 0
-            deleted = 0
-
-            sorted_hours = sorted(hourly_data.keys())
-            if not sorted_hours:
-                conn.close()
-                return {"error": "No hourly data found"}, 404
-
-            earliest_ts = sorted_hours[0]
-            latest_ts = sorted_hours[-1]
-
-            self.log(f"Processing {len(sorted_hours)} hours from {datetime.fromtimestamp(earliest_ts)} to {datetime.fromtimestamp(latest_ts)}")
-
-            # Seed cumulative sum from the last statistics entry before our earliest state.
-            # If no prior entry exists (e.g. first ever run), start from 0.
-            cursor.execute("""
-                SELECT sum FROM statistics
-                WHERE metadata_id = ? AND start_ts < ?
-                ORDER BY start_ts DESC
-                LIMIT 1
-            """, (stats_metadata_id, earliest_ts))
-            row = cursor.fetchone()
-            cumulative_sum = row[0] if row else 0.0
-            self.log(f"Seeding cumulative sum from prior statistics: {cumulative_sum:.2f}")
-
-            # Delete any statistics for hours that don't have corresponding states.
-            # Also delete stats beyond latest_ts up to now — stale entries from a previous
-            # run that covered more days than the current data cause negative spikes.
-            if not clear_existing:
-                now_ts = time.time()
+            with self._write_transaction() as cursor:
+                # Get statistics metadata_id
+                stats_metadata_id = self._get_stats_metadata_id(cursor, entity_id)
+                if stats_metadata_id is None:
+                    return {"error": "No statistics metadata found"}, 404
+
+                # Get states metadata_id
+                states_metadata_id = self._get_states_metadata_id(cursor, entity_id)
+                if states_metadata_id is None:
+                    return {"error": "No states found"}, 404
+
+                # Optionally clear existing statistics to ensure clean regeneration
+                if clear_existing:
+                    cursor.execute("DELETE FROM statistics WHERE metadata_id = ?", (stats_metadata_id,))
+                    cursor.execute("DELETE FROM statistics_short_term WHERE metadata_id = ?", (stats_metadata_id,))
+                    self.log(f"Cleared existing statistics for metadata_id {stats_metadata_id}")
+
+                since_ts = 0
+                if not clear_existing and not full_rebuild and stats_metadata_id in self._stats_resume:
+                    since_ts = self._stats_resume[stats_metadata_id]
+                    since_ts = min(since_ts, self._states_backfilled_from.get(states_metadata_id, since_ts))
+                    self.log(f"Regenerating statistics from {datetime.fromtimestamp(since_ts)} onward")
+
+                # Bucket the window's states by hour once; the range probe, orphan
+                # cleanup and upsert below all read the materialized hours.
+                cursor.execute("INSERT INTO hourly_readings (hour_ts, consumption)" + HOURLY_STATES_CTE + """
+                    SELECT hour_ts, consumption FROM readings
+                """, (states_metadata_id, since_ts))
+
+                # Hour range, hour count and total consumption of the window. An empty
+                # range means there is nothing to regenerate.
                 cursor.execute("""
-                    DELETE FROM statistics
-                    WHERE metadata_id = ?
-                    AND start_ts >= ?
-                    AND start_ts <= ?
-                    AND start_ts NOT IN ({})
-                """.format(','.join('?' * len(sorted_hours))),
-                    [stats_metadata_id, earliest_ts, now_ts] + sorted_hours)
-                deleted = cursor.rowcount
-                if deleted > 0:
-                    self.log(f"Deleted {deleted} orphaned statistics entries")
-
-            for hour_ts in sorted_hours:
-                hour_consumption = hourly_data[hour_ts]
-                cumulative_sum += hour_consumption
-
-                # Check if exists
+                    SELECT MIN(hour_ts), MAX(hour_ts), COUNT(*), SUM(consumption)
+                    FROM hourly_readings
+                """)
+                earliest_ts, latest_ts, total_hours, total_consumption = cursor.fetchone()
+
+                if not total_hours:
+                    return {"error": "No valid states found"}, 404
+
+                # Recalculate cumulative sum starting from where existing statistics left off.
+                # This handles the case where HA has purged old states — without this, the sum
+                # would reset to 0 at the earliest available state, creating a huge negative
+                # delta in the Energy dashboard at the state retention boundary.
+                deleted = 0
+
+                self.log(f"Processing {total_hours} hours from {datetime.fromtimestamp(earliest_ts)} to {datetime.fromtimestamp(latest_ts)}")
+
+                # Seed cumulative sum from the last statistics entry before our earliest state.
+                # If no prior entry exists (e.g. first ever run), start from 0.
+                cursor.execute(PRIOR_SUM_SQL, (stats_metadata_id, earliest_ts))
+                row = cursor.fetchone()
+                seed_sum = row[0] if row else 0.0
+                self.log(f"Seeding cumulative sum from prior statistics: {seed_sum:.2f}")
+
+                # Delete any statistics for hours that don't have corresponding states.
+                # Also delete stats beyond latest_ts up to now — stale entries from a previous
+                # run that covered more days than the current data cause negative spikes.
+                if not clear_existing:
+                    now_ts = time.time()
+                    cursor.execute("""
+                        DELETE FROM statistics
+                        WHERE metadata_id = ?
+                        AND start_ts >= ?
+                        AND start_ts <= ?
+                        AND start_ts NOT IN (SELECT hour_ts FROM hourly_readings)
+                    """, (stats_metadata_id, earliest_ts, now_ts))
+                    deleted = cursor.rowcount
+                    if deleted > 0:
+                        self.log(f"Deleted {deleted} orphaned statistics entries")
+
+                # Every hour left in [earliest_ts, latest_ts] after the orphan cleanup is
+                # one we are about to rewrite, so counting them up front gives the split
+                # between updated and inserted rows without probing each hour.
                 cursor.execute("""
-                    SELECT id FROM statistics
-                    WHERE metadata_id = ? AND start_ts = ?
-                """, (stats_metadata_id, hour_ts))
+                    SELECT COUNT(*) FROM statistics
+                    WHERE metadata_id = ? AND start_ts >= ? AND start_ts <= ?
+                """, (stats_metadata_id, earliest_ts, latest_ts))
+                updated = cursor.fetchone()[0]
+                inserted = total_hours - updated
+
+                # Compute the running total over the hours (already in hour_ts order, the
+                # table's primary key) and stream the rows straight into the upsert.
+                hourly_data = self._conn.execute("""
+                    SELECT hour_ts, consumption, SUM(consumption) OVER (ORDER BY hour_ts)
+                    FROM hourly_readings
+                    ORDER BY hour_ts
+                """)
+
+                cursor.executemany(UPSERT_STATISTICS_SQL, (
+                    (stats_metadata_id, hour_ts, hour_ts, hour_consumption, seed_sum + running_sum)
+                    for hour_ts, hour_consumption, running_sum in hourly_data
+                ))
+                cumulative_sum = seed_sum + total_consumption
+                cursor.execute("DELETE FROM hourly_readings")
 
-                if cursor.fetchone():
-                    cursor.execute("""
-                        UPDATE statistics
-                        SET state = ?, sum = ?
-                        WHERE metadata_id = ? AND start_ts = ?
-                    """, (hour_consumption, cumulative_sum, stats_metadata_id, hour_ts))
-                    updated += 1
-                else:
-                    cursor.execute("""
-                        INSERT INTO statistics (metadata_id, start_ts, created_ts, state, sum)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (stats_metadata_id, hour_ts, hour_ts, hour_consumption, cumulative_sum))
-                    inserted += 1
+                cursor.execute("COMMIT")
 
-            conn.commit()
-            conn.close()
+                self._stats_resume[stats_metadata_id] = latest_ts
+                self._states_backfilled_from.pop(states_metadata_id, None)
+                self._stats_rewritten_from[stats_metadata_id] = min(
+                    earliest_ts, self._stats_rewritten_from.get(stats_metadata_id, earliest_ts))
 
-            self.log(f"Generated statistics: {inserted} inserted, {updated} updated, {deleted} orphans deleted, final sum: {cumulative_sum:.2f}")
+                self.log(f"Generated statistics: {inserted} inserted, {updated} updated, {deleted} orphans deleted, final sum: {cumulative_sum:.2f}")
 
-            return {
-                "status": "success",
-                "inserted": inserted,
-                "updated": updated,
-                "deleted": deleted,
-                "total_hours": len(hourly_data),
-                "final_sum": cumulative_sum
-            }, 200
+                return {
+                    "status": "success",
+                    "inserted": inserted,
+                    "updated": updated,
+                    "deleted": deleted,
+                    "total_hours": total_hours,
+                    "final_sum": cumulative_sum
+                }, 200
 
         except Exception as e:
             self.log(f"Statistics generation error: {str(e)}", level="ERROR")
-            if 'conn' in locals():
-                conn.close()
             return {"error": str(e)}, 500
 
     def generate_cost_statistics(self, data, **kwargs):
-        """Generate cost statistics from energy usage statistics"""
+        """Generate cost statistics from energy usage statistics
+
+        Like generate_statistics, only regenerates from where the energy statistics
+        changed since the previous run, unless clear_existing or full_rebuild is set
+        or the rate differs from the one used last time.
+        """
         energy_entity_id = data.get("energy_entity_id")
         cost_entity_id = data.get("cost_entity_id")
         rate = data.get("rate")  # Optional - will auto-calculate if not provided
         clear_existing = data.get("clear_existing", False)
+        full_rebuild = data.get("full_rebuild", False)
 
         if not energy_entity_id or not cost_entity_id:
             return {"error": "energy_entity_id and cost_entity_id required"}, 400
 
+        # A provided rate is checked before anything is written. SQLite stores NaN
+        # as NULL, so a NaN rate would silently null out every cost row.
+        if rate:
+            try:
+                rate = float(rate)
+            except (TypeError, ValueError):
+                return {"error": "rate must be a number"}, 400
+            if not (math.isfinite(rate) and rate > 0):
+                return {"error": "rate must be a number"}, 400
+
+        return self._run_endpoint(self._generate_cost_statistics, energy_entity_id, cost_entity_id, rate, clear_existing, full_rebuild)
+
+    def _generate_cost_statistics(self, energy_entity_id, cost_entity_id, rate, clear_existing, full_rebuild):
+        """Rebuild hourly cost statistics; runs on the database worker"""
         try:
-            conn = sqlite3.connect('/homeassistant/home-assistant_v2.db', timeout=30)
-            cursor = conn.cursor()
-
-            # Get energy statistics metadata_id
-            cursor.execute("SELECT id FROM statistics_meta WHERE statistic_id = ?", (energy_entity_id,))
-            row = cursor.fetchone()
-            if not row:
-                conn.close()
-                return {"error": f"No statistics metadata found for {energy_entity_id}"}, 404
-            energy_stats_id = row[0]
-
-            # Get cost statistics metadata_id
-            cursor.execute("SELECT id FROM statistics_meta WHERE statistic_id = ?", (cost_entity_id,))
-            row = cursor.fetchone()
-            if not row:
-                conn.close()
-                return {"error": f"No statistics metadata found for {cost_entity_id}"}, 404
-            cost_stats_id = row[0]
-
-            # Optionally clear existing cost statistics
-            if clear_existing:
-                cursor.execute("DELETE FROM statistics WHERE metadata_id = ?", (cost_stats_id,))
-                cursor.execute("DELETE FROM statistics_short_term WHERE metadata_id = ?", (cost_stats_id,))
-                self.log(f"Cleared existing cost statistics for metadata_id {cost_stats_id}")
-
-            # Auto-calculate rate if not provided
-            if not rate:
-                self.log("Rate not provided, attempting to auto-calculate from existing cost statistics")
-
-                # Get the most recent cost and energy statistics for the same timestamp
-                cursor.execute("""
-                    SELECT e.start_ts, e.state, c.state
-                    FROM statistics e
-                    JOIN statistics c ON e.start_ts = c.start_ts
-                    WHERE e.metadata_id = ?
-                    AND c.metadata_id = ?
-                    AND e.state IS NOT NULL
-                    AND c.state IS NOT NULL
-                    AND e.state > 0
-                    AND c.state > 0
-                    ORDER BY e.start_ts DESC
-                    LIMIT 1
-                """, (energy_stats_id, cost_stats_id))
-
-                rate_calc_row = cursor.fetchone()
-                if rate_calc_row:
-                    _, energy_kwh, hour_cost = rate_calc_row
-                    rate = float(hour_cost) / float(energy_kwh)
-                    self.log(f"Auto-calculated rate: {rate:.5f} (from energy={energy_kwh} kWh, cost={hour_cost})")
+            with self._write_transaction() as cursor:
+                # Get energy statistics metadata_id
+                energy_stats_id = self._get_stats_metadata_id(cursor, energy_entity_id)
+                if energy_stats_id is None:
+                    return {"error": f"No statistics metadata found for {energy_entity_id}"}, 404
+
+                # Get cost statistics metadata_id
+                cost_stats_id = self._get_stats_metadata_id(cursor, cost_entity_id)
+                if cost_stats_id is None:
+                    return {"error": f"No statistics metadata found for {cost_entity_id}"}, 404
+
+                # Optionally clear existing cost statistics
+                if clear_existing:
+                    cursor.execute("DELETE FROM statistics WHERE metadata_id = ?", (cost_stats_id,))
+                    cursor.execute("DELETE FROM statistics_short_term WHERE metadata_id = ?", (cost_stats_id,))
+                    self.log(f"Cleared existing cost statistics for metadata_id {cost_stats_id}")
+
+                # Auto-calculate rate if not provided
+                if not rate:
+                    self.log("Rate not provided, attempting to auto-calculate from existing cost statistics")
+
+                    # Get the most recent cost and energy statistics for the same timestamp
+                    cursor.execute("""
+                        SELECT e.start_ts, e.state, c.state
+                        FROM statistics e
+                        JOIN statistics c ON e.start_ts = c.start_ts
+                        WHERE e.metadata_id = ?
+                        AND c.metadata_id = ?
+                        AND e.state IS NOT NULL
+                        AND c.state IS NOT NULL
+                        AND e.state > 0
+                        AND c.state > 0
+                        ORDER BY e.start_ts DESC
+                        LIMIT 1
+                    """, (energy_stats_id, cost_stats_id))
+
+                    rate_calc_row = cursor.fetchone()
+                    if rate_calc_row:
+                        _, energy_kwh, hour_cost = rate_calc_row
+                        rate = hour_cost / energy_kwh
+                        self.log(f"Auto-calculated rate: {rate:.5f} (from energy={energy_kwh} kWh, cost={hour_cost})")
+                    else:
+                        return {"error": "Could not auto-calculate rate: no existing cost statistics found. Please provide rate parameter."}, 400
                 else:
-                    conn.close()
-                    return {"error": "Could not auto-calculate rate: no existing cost statistics found. Please provide rate parameter."}, 400
-            else:
-                try:
-                    rate = float(rate)
                     self.log(f"Using provided rate: {rate:.5f}")
-                except ValueError:
-                    conn.close()
-                    return {"error": "rate must be a number"}, 400
-
-            # Get all energy statistics in chronological order
-            cursor.execute("""
-                SELECT start_ts, state
-                FROM statistics
-                WHERE metadata_id = ?
-                ORDER BY start_ts
-            """, (energy_stats_id,))
-
-            energy_stats = cursor.fetchall()
-
-            if not energy_stats:
-                conn.close()
-                return {"error": "No energy statistics found"}, 404
-
-            # Recalculate cumulative cost seeded from the last prior statistics entry.
-            # Same fix as generate_statistics: prevents reset-to-zero at the state
-            # retention boundary causing negative spikes in the Energy dashboard.
-            inserted = 0
-            updated = 0
-
-            earliest_ts = energy_stats[0][0]
-            latest_ts = energy_stats[-1][0]
-            energy_timestamps = [ts for ts, _ in energy_stats]
-
-            self.log(f"Processing {len(energy_stats)} hours from {datetime.fromtimestamp(earliest_ts)} to {datetime.fromtimestamp(latest_ts)}")
-
-            # Seed cumulative cost from the last cost statistics entry before our range.
-            cursor.execute("""
-                SELECT sum FROM statistics
-                WHERE metadata_id = ? AND start_ts < ?
-                ORDER BY start_ts DESC
-                LIMIT 1
-            """, (cost_stats_id, earliest_ts))
-            row = cursor.fetchone()
-            cumulative_cost = row[0] if row else 0.0
-            self.log(f"Seeding cumulative cost from prior statistics: {cumulative_cost:.2f}")
-
-            # Delete orphaned cost statistics (hours without corresponding energy stats).
-            # Upper bound is now_ts, not latest_ts, to catch stale future entries.
-            if not clear_existing:
-                now_ts = time.time()
+
+                since_ts = 0
+                resume = self._cost_resume.get(cost_stats_id)
+                if not clear_existing and not full_rebuild and resume and math.isclose(resume[1], rate):
+                    since_ts = min(resume[0], self._stats_rewritten_from.get(energy_stats_id, resume[0]))
+                    self.log(f"Regenerating cost statistics from {datetime.fromtimestamp(since_ts)} onward")
+
+                # Hour range and row counts of the energy statistics in the window
                 cursor.execute("""
-                    DELETE FROM statistics
+                    SELECT MIN(start_ts), MAX(start_ts), COUNT(*), COUNT(state)
+                    FROM statistics
                     WHERE metadata_id = ?
                     AND start_ts >= ?
-                    AND start_ts <= ?
-                    AND start_ts NOT IN ({})
-                """.format(','.join('?' * len(energy_timestamps))),
-                    [cost_stats_id, earliest_ts, now_ts] + energy_timestamps)
-                deleted = cursor.rowcount
-                if deleted > 0:
-                    self.log(f"Deleted {deleted} orphaned cost statistics entries")
-
-            for start_ts, energy_kwh in energy_stats:
-                if energy_kwh is None:
-                    continue
+                """, (energy_stats_id, since_ts))
+                earliest_ts, latest_ts, total_hours, priced_hours = cursor.fetchone()
+
+                if not total_hours:
+                    return {"error": "No energy statistics found"}, 404
+
+                # Recalculate cumulative cost seeded from the last prior statistics entry.
+                # Same fix as generate_statistics: prevents reset-to-zero at the state
+                # retention boundary causing negative spikes in the Energy dashboard.
+                self.log(f"Processing {total_hours} hours from {datetime.fromtimestamp(earliest_ts)} to {datetime.fromtimestamp(latest_ts)}")
+
+                # Seed cumulative cost from the last cost statistics entry before our range.
+                cursor.execute(PRIOR_SUM_SQL, (cost_stats_id, earliest_ts))
+                row = cursor.fetchone()
+                seed_cost = row[0] if row else 0.0
+                self.log(f"Seeding cumulative cost from prior statistics: {seed_cost:.2f}")
+
+                # Delete orphaned cost statistics (hours without corresponding energy stats).
+                # Upper bound is now_ts, not latest_ts, to catch stale future entries.
+                if not clear_existing:
+                    now_ts = time.time()
+                    cursor.execute("""
+                        DELETE FROM statistics
+                        WHERE metadata_id = ?
+                        AND start_ts >= ?
+                        AND start_ts <= ?
+                        AND start_ts NOT IN (
+                            SELECT start_ts FROM statistics
+                            WHERE metadata_id = ? AND start_ts >= ?
+                        )
+                    """, (cost_stats_id, earliest_ts, now_ts, energy_stats_id, earliest_ts))
+                    deleted = cursor.rowcount
+                    if deleted > 0:
+                        self.log(f"Deleted {deleted} orphaned cost statistics entries")
+
+                # Same accounting as generate_statistics: whatever survives the orphan
+                # cleanup inside our range is about to be updated. Only hours with an
+                # energy state are priced, so cost rows at NULL-state hours don't count.
+                cursor.execute("""
+                    SELECT COUNT(*) FROM statistics
+                    WHERE metadata_id = ? AND start_ts >= ? AND start_ts <= ?
+                    AND start_ts IN (
+                        SELECT start_ts FROM statistics
+                        WHERE metadata_id = ? AND start_ts >= ? AND state IS NOT NULL
+                    )
+                """, (cost_stats_id, earliest_ts, latest_ts, energy_stats_id, earliest_ts))
+                updated = cursor.fetchone()[0]
+                inserted = priced_hours - updated
 
-                # Calculate cost for this hour
-                hour_cost = float(energy_kwh) * rate
-                cumulative_cost += hour_cost
+                # Price every energy hour and write the running cost in one statement
+                cursor.execute(UPSERT_COST_STATISTICS_SQL, (
+                    cost_stats_id, rate, seed_cost, rate, energy_stats_id, earliest_ts))
 
-                # Check if cost statistic exists
-                cursor.execute("""
-                    SELECT id FROM statistics
-                    WHERE metadata_id = ? AND start_ts = ?
-                """, (cost_stats_id, start_ts))
+                cursor.execute(PRIOR_SUM_SQL, (cost_stats_id, latest_ts + 1))
+                row = cursor.fetchone()
+                cumulative_cost = row[0] if row else seed_cost
 
-                if cursor.fetchone():
-                    cursor.execute("""
-                        UPDATE statistics
-                        SET state = ?, sum = ?
-                        WHERE metadata_id = ? AND start_ts = ?
-                    """, (hour_cost, cumulative_cost, cost_stats_id, start_ts))
-                    updated += 1
-                else:
-                    cursor.execute("""
-                        INSERT INTO statistics (metadata_id, start_ts, created_ts, state, sum)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (cost_stats_id, start_ts, start_ts, hour_cost, cumulative_cost))
-                    inserted += 1
+                cursor.execute("COMMIT")
 
-            conn.commit()
-            conn.close()
+                self._cost_resume[cost_stats_id] = (latest_ts, rate)
+                self._stats_rewritten_from.pop(energy_stats_id, None)
 
-            self.log(f"Generated cost statistics: {inserted} inserted, {updated} updated, final cost: ${cumulative_cost:.2f}")
+                self.log(f"Generated cost statistics: {inserted} inserted, {updated} updated, final cost: ${cumulative_cost:.2f}")
 
-            return {
-                "status": "success",
-                "inserted": inserted,
-                "updated": updated,
-                "total_hours": len(energy_stats),
-                "total_cost": cumulative_cost,
-                "rate_used": rate
-            }, 200
+                return {
+                    "status": "success",
+                    "inserted": inserted,
+                    "updated": updated,
+                    "total_hours": total_hours,
+                    "total_cost": cumulative_cost,
+                    "rate_used": rate
+                }, 200
 
         except Exception as e:
             self.log(f"Cost statistics generation error: {str(e)}", level="ERROR")
-            if 'conn' in locals():
-                conn.close()
             return {"error": str(e)}, 500
+
+    def _get_states_metadata_id(self, cursor, entity_id, create=False):
+        """Return the states_meta id for entity_id, creating the row if asked to.
+
+        Returns None when the entity is unknown and create is False.
+        """
+        metadata_id = self._meta_cache.get(entity_id)
+        if metadata_id is not None:
+            return metadata_id
+
+        if create:
+            # HA's ix_states_meta_entity_id is unique, so this is a no-op when the
+            # entity already exists and never creates a second row for it
+            cursor.execute("INSERT OR IGNORE INTO states_meta (entity_id) VALUES (?)", (entity_id,))
+        cursor.execute("SELECT metadata_id FROM states_meta WHERE entity_id = ?", (entity_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+
+        self._meta_cache[entity_id] = row[0]
+        return row[0]
+
+    def _get_stats_metadata_id(self, cursor, statistic_id):
+        """Return the statistics_meta id for statistic_id, or None if HA has none yet"""
+        metadata_id = self._stats_meta_cache.get(statistic_id)
+        if metadata_id is not None:
+            return metadata_id
+
+        cursor.execute("SELECT id FROM statistics_meta WHERE statistic_id = ?", (statistic_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+
+        self._stats_meta_cache[statistic_id] = row[0]
+        return row[0]
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import sys
+import types
+from datetime import datetime, timezone
+
+import pytest
+
+# backfill_state imports AppDaemon's hassapi, which only exists inside AppDaemon.
+# A minimal stand-in is enough: the app only registers endpoints and logs.
+hassapi = types.ModuleType("hassapi")
+
+
+class Hass:
+    def __init__(self):
+        self.logs = []
+
+    def register_endpoint(self, callback, endpoint):
+        pass
+
+    def log(self, msg, level="INFO"):
+        self.logs.append((level, msg))
+
+
+hassapi.Hass = Hass
+sys.modules.setdefault("hassapi", hassapi)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backfill_state  # noqa: E402
+
+ENTITY_ID = "sensor.energy"
+COST_ENTITY_ID = "sensor.energy_cost"
+BASE_TS = int(datetime(2024, 3, 1, tzinfo=timezone.utc).timestamp())
+
+# The parts of Home Assistant's recorder schema the app reads and writes
+HA_SCHEMA = """
+CREATE TABLE states_meta (metadata_id INTEGER PRIMARY KEY, entity_id VARCHAR(255));
+CREATE UNIQUE INDEX ix_states_meta_entity_id ON states_meta (entity_id);
+CREATE TABLE states (
+    state_id INTEGER PRIMARY KEY, state VARCHAR(255), attributes CHAR(0),
+    last_changed_ts FLOAT, last_updated_ts FLOAT, metadata_id INTEGER
+);
+CREATE INDEX ix_states_metadata_id_last_updated_ts ON states (metadata_id, last_updated_ts);
+CREATE TABLE statistics_meta (
+    id INTEGER PRIMARY KEY, statistic_id VARCHAR(255), source VARCHAR(32),
+    unit_of_measurement VARCHAR(255), has_mean BOOLEAN, has_sum BOOLEAN, name VARCHAR(255)
+);
+CREATE UNIQUE INDEX ix_statistics_meta_statistic_id ON statistics_meta (statistic_id);
+CREATE TABLE statistics (
+    id INTEGER PRIMARY KEY, created_ts FLOAT, metadata_id INTEGER, start_ts FLOAT,
+    mean FLOAT, min FLOAT, max FLOAT, last_reset_ts FLOAT, state FLOAT, sum FLOAT
+);
+CREATE UNIQUE INDEX ix_statistics_statistic_id_start_ts ON statistics (metadata_id, start_ts);
+CREATE TABLE statistics_short_term (
+    id INTEGER PRIMARY KEY, created_ts FLOAT, metadata_id INTEGER, start_ts FLOAT,
+    mean FLOAT, min FLOAT, max FLOAT, last_reset_ts FLOAT, state FLOAT, sum FLOAT
+);
+CREATE UNIQUE INDEX ix_statistics_short_term_statistic_id_start_ts
+    ON statistics_short_term (metadata_id, start_ts);
+"""
+
+
+def hour_ts(hour):
+    """Epoch seconds of the given hour offset from BASE_TS"""
+    return BASE_TS + hour * 3600
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def reading(hour, kwh):
+    """A backfill point in the format the Go publisher sends"""
+    timestamp = iso(hour_ts(hour))
+    return {"state": f"{kwh:.2f}", "last_changed": timestamp, "last_updated": timestamp}
+
+
+def consumption(hour):
+    """Deterministic, non-zero hourly consumption for test data"""
+    return (hour % 7) * 0.37 + 0.1
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "home-assistant_v2.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(HA_SCHEMA)
+    conn.execute(
+        "INSERT INTO statistics_meta (statistic_id) VALUES (?), (?)", (ENTITY_ID, COST_ENTITY_ID))
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(backfill_state, "DB_PATH", path)
+    return path
+
+
+@pytest.fixture
+def db(db_path):
+    """A separate connection for inspecting what the app wrote"""
+    conn = sqlite3.connect(db_path)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def app(db_path):
+    app = backfill_state.BackfillState()
+    app.initialize()
+    yield app
+    app.terminate()
+
+
+@pytest.fixture
+def backfill(app):
+    """Backfill consumption(hour) for each hour in one batch"""
+    def backfill(hours, kwh=consumption):
+        return app.backfill_state({
+            "entity_id": ENTITY_ID,
+            "points": [reading(hour, kwh(hour)) for hour in hours],
+        })
+    return backfill
+
+
+def statistics(db, statistic_id):
+    """[(start_ts, state, sum), ...] for one statistic, oldest first"""
+    return db.execute("""
+        SELECT s.start_ts, s.state, s.sum FROM statistics s
+        JOIN statistics_meta m ON m.id = s.metadata_id
+        WHERE m.statistic_id = ?
+        ORDER BY s.start_ts
+    """, (statistic_id,)).fetchall()
@@ -0,0 +1,197 @@
+import sqlite3
+import threading
+
+import pytest
+
+import backfill_state
+from conftest import ENTITY_ID, hour_ts, reading
+
+
+def stored_states(db, entity_id=ENTITY_ID):
+    """[(state, last_changed_ts), ...] stored for one entity, oldest first"""
+    return db.execute("""
+        SELECT s.state, s.last_changed_ts FROM states s
+        JOIN states_meta m ON m.metadata_id = s.metadata_id
+        WHERE m.entity_id = ?
+        ORDER BY s.last_changed_ts
+    """, (entity_id,)).fetchall()
+
+
+def fail_inserts_of(db, state):
+    """Make any insert of the given state value abort with a database error"""
+    db.execute(f"""
+        CREATE TRIGGER fail_insert BEFORE INSERT ON states
+        WHEN NEW.state = '{state}'
+        BEGIN SELECT RAISE(ABORT, 'simulated failure'); END
+    """)
+    db.commit()
+
+
+def test_single_reading_is_stored(app, db):
+    response = app.backfill_state(dict({"entity_id": ENTITY_ID}, **reading(0, 1.5)))
+
+    assert response == ({"status": "success"}, 200)
+    assert stored_states(db) == [("1.50", hour_ts(0))]
+
+
+def test_single_reading_duplicate_is_skipped(app, db):
+    app.backfill_state(dict({"entity_id": ENTITY_ID}, **reading(0, 1.5)))
+
+    response = app.backfill_state(dict({"entity_id": ENTITY_ID}, **reading(0, 2.5)))
+
+    assert response == ({"status": "skipped", "reason": "duplicate"}, 200)
+    assert stored_states(db) == [("1.50", hour_ts(0))]
+
+
+@pytest.mark.parametrize("state", ["unknown", "unavailable", "0.00", "-1", "1_5", "inf"])
+def test_single_non_numeric_reading_is_skipped(app, db, state):
+    point = dict(reading(0, 1), state=state)
+
+    response = app.backfill_state(dict({"entity_id": ENTITY_ID}, **point))
+
+    assert response == ({"status": "skipped", "reason": "non-numeric"}, 200)
+    assert stored_states(db) == []
+
+
+def test_epoch_timestamps_are_accepted(app, db):
+    response = app.backfill_state({"entity_id": ENTITY_ID, "state": "1.50",
+                                   "last_changed_ts": hour_ts(3)})
+
+    assert response == ({"status": "success"}, 200)
+    assert stored_states(db) == [("1.50", hour_ts(3))]
+
+
+@pytest.mark.parametrize("epoch", [
+    hour_ts(3) * 1000,  # milliseconds
+    -hour_ts(3),
+    0,
+    float("nan"),
+])
+def test_out_of_range_epoch_timestamps_are_rejected(app, db, epoch):
+    response, status = app.backfill_state({"entity_id": ENTITY_ID, "state": "1.50",
+                                           "last_changed_ts": epoch})
+
+    assert status == 400
+    assert response["error"].startswith("Invalid timestamp")
+    assert stored_states(db) == []
+
+
+def test_out_of_range_epoch_last_updated_is_rejected(app, db):
+    response, status = app.backfill_state({"entity_id": ENTITY_ID, "state": "1.50",
+                                           "last_changed_ts": hour_ts(3),
+                                           "last_updated_ts": hour_ts(3) * 1000})
+
+    assert status == 400
+    assert stored_states(db) == []
+
+
+@pytest.mark.parametrize("data", [
+    {"state": "1.50"},
+    {"last_changed": "2024-03-01T00:00:00Z"},
+    {"points": []},
+    {"points": [{"state": "1.50"}]},
+])
+def test_missing_parameters_are_rejected(app, data):
+    response, status = app.backfill_state(dict({"entity_id": ENTITY_ID}, **data))
+
+    assert status == 400
+    assert response == {"error": "Missing required parameters"}
+
+
+@pytest.mark.parametrize("last_changed", ["garbage", 123])
+def test_invalid_timestamp_is_rejected(app, last_changed):
+    response, status = app.backfill_state({"entity_id": ENTITY_ID, "state": "1.50",
+                                           "last_changed": last_changed})
+
+    assert status == 400
+    assert response["error"].startswith("Invalid timestamp")
+
+
+def test_batch_counts_inserted_and_skipped(app, db):
+    points = [reading(hour, 1) for hour in range(5)] + [dict(reading(5, 1), state="unknown")]
+
+    response = app.backfill_state({"entity_id": ENTITY_ID, "points": points})
+
+    assert response == ({"status": "success", "inserted": 5, "skipped": 1}, 200)
+    assert len(stored_states(db)) == 5
+
+
+def test_batch_skips_duplicates_within_the_batch(app, db):
+    points = [reading(0, 1), reading(1, 1), reading(0, 2)]
+
+    response = app.backfill_state({"entity_id": ENTITY_ID, "points": points})
+
+    assert response == ({"status": "success", "inserted": 2, "skipped": 1}, 200)
+    assert stored_states(db) == [("1.00", hour_ts(0)), ("1.00", hour_ts(1))]
+
+
+def test_batch_skips_duplicates_across_batches(app, db):
+    app.backfill_state({"entity_id": ENTITY_ID, "points": [reading(hour, 1) for hour in range(3)]})
+
+    response = app.backfill_state({"entity_id": ENTITY_ID,
+                                   "points": [reading(hour, 2) for hour in range(1, 5)]})
+
+    assert response == ({"status": "success", "inserted": 2, "skipped": 2}, 200)
+    assert [state for state, _ in stored_states(db)] == ["1.00", "1.00", "1.00", "2.00", "2.00"]
+
+
+def test_batch_of_only_rejected_readings_is_all_skipped(app, db):
+    points = [dict(reading(hour, 1), state="0.00") for hour in range(3)]
+
+    response = app.backfill_state({"entity_id": ENTITY_ID, "points": points})
+
+    assert response == ({"status": "success", "inserted": 0, "skipped": 3}, 200)
+    assert stored_states(db) == []
+
+
+def test_batch_is_rolled_back_on_database_error(app, db):
+    app.backfill_state({"entity_id": ENTITY_ID, "points": [reading(0, 1)]})
+    fail_inserts_of(db, "6.66")
+
+    response, status = app.backfill_state({"entity_id": ENTITY_ID, "points": [
+        reading(1, 1), reading(2, 6.66), reading(3, 1)]})
+
+    assert status == 500
+    assert "error" in response
+    assert stored_states(db) == [("1.00", hour_ts(0))]
+
+
+def test_rolled_back_entity_is_evicted_from_meta_cache(app, db):
+    fail_inserts_of(db, "6.66")
+
+    _, status = app.backfill_state({"entity_id": "sensor.new", "points": [reading(0, 6.66)]})
+
+    assert status == 500
+    assert "sensor.new" not in app._meta_cache
+    assert db.execute("SELECT COUNT(*) FROM states_meta WHERE entity_id = 'sensor.new'").fetchone() == (0,)
+
+    # The next call creates the entity again instead of reusing the rolled back id
+    response = app.backfill_state({"entity_id": "sensor.new", "points": [reading(0, 1)]})
+
+    assert response == ({"status": "success", "inserted": 1, "skipped": 0}, 200)
+    assert stored_states(db, "sensor.new") == [("1.00", hour_ts(0))]
+
+
+def test_busy_database_worker_answers_503(app, db, monkeypatch):
+    monkeypatch.setattr(backfill_state, "DB_TIMEOUT", 0.1)
+    release = threading.Event()
+    blocker = app._db_executor.submit(release.wait)
+
+    response = app.backfill_state(dict({"entity_id": ENTITY_ID}, **reading(0, 1.5)))
+    release.set()
+    blocker.result()
+
+    assert response == ({"error": "Database busy, try again later"}, 503)
+    # The timed out job was still queued, so it never ran
+    assert app._run_db(lambda: None) is None
+    assert stored_states(db) == []
+
+
+def test_terminate_after_failed_initialize(tmp_path, monkeypatch):
+    monkeypatch.setattr(backfill_state, "DB_PATH", str(tmp_path / "missing" / "ha.db"))
+    app = backfill_state.BackfillState()
+
+    with pytest.raises(sqlite3.OperationalError):
+        app.initialize()
+
+    app.terminate()
@@ -0,0 +1,204 @@
+import pytest
+
+from conftest import COST_ENTITY_ID, ENTITY_ID, consumption, hour_ts, statistics
+
+
+def generate(app, **options):
+    return app.generate_statistics(dict({"entity_id": ENTITY_ID}, **options))
+
+
+def generate_cost(app, rate="0.2", **options):
+    return app.generate_cost_statistics(dict({
+        "energy_entity_id": ENTITY_ID,
+        "cost_entity_id": COST_ENTITY_ID,
+        "rate": rate,
+    }, **options))
+
+
+def assert_same_statistics(actual, expected):
+    assert [row[0] for row in actual] == [row[0] for row in expected]
+    for (_, state, total), (_, expected_state, expected_total) in zip(actual, expected):
+        assert state == pytest.approx(expected_state)
+        assert total == pytest.approx(expected_total)
+
+
+def full_rebuild(app, db):
+    """Statistics as a full rebuild writes them, for comparison with incremental runs"""
+    assert generate(app, full_rebuild=True)[1] == 200
+    assert generate_cost(app, full_rebuild=True)[1] == 200
+    return statistics(db, ENTITY_ID), statistics(db, COST_ENTITY_ID)
+
+
+def test_full_run_sums_latest_reading_per_hour(app, db, backfill):
+    backfill(range(24))
+    # A later reading within hour 5 replaces the earlier one rather than adding to it
+    app.backfill_state({"entity_id": ENTITY_ID, "state": "9.00",
+                        "last_changed": "2024-03-01T05:30:00Z"})
+
+    response, status = generate(app)
+
+    assert status == 200
+    assert response["inserted"] == 24
+    assert response["updated"] == 0
+    expected = [consumption(hour) for hour in range(24)]
+    expected[5] = 9.0
+    assert [row[1] for row in statistics(db, ENTITY_ID)] == pytest.approx(expected)
+    assert response["final_sum"] == pytest.approx(sum(expected))
+
+
+def test_incremental_run_matches_full_rebuild(app, db, backfill):
+    backfill(range(48))
+    generate(app)
+    generate_cost(app)
+    backfill(range(48, 72))
+
+    response, status = generate(app)
+    cost_response, cost_status = generate_cost(app)
+
+    assert status == 200 and cost_status == 200
+    # Only the previous run's last hour and the new hours are regenerated
+    assert response["total_hours"] == 25
+    assert cost_response["total_hours"] == 25
+    incremental = statistics(db, ENTITY_ID), statistics(db, COST_ENTITY_ID)
+    energy, cost = full_rebuild(app, db)
+    assert len(energy) == 72
+    assert_same_statistics(incremental[0], energy)
+    assert_same_statistics(incremental[1], cost)
+
+
+def test_backfill_older_than_resume_point_is_picked_up(app, db, backfill):
+    backfill(range(24, 72))
+    generate(app)
+    generate_cost(app)
+    backfill(range(24))
+
+    response, _ = generate(app)
+    generate_cost(app)
+
+    assert response["total_hours"] == 72
+    assert response["inserted"] == 24
+    incremental = statistics(db, ENTITY_ID), statistics(db, COST_ENTITY_ID)
+    energy, cost = full_rebuild(app, db)
+    assert incremental[0][0][0] == hour_ts(0)
+    assert_same_statistics(incremental[0], energy)
+    assert_same_statistics(incremental[1], cost)
+
+
+def test_rate_change_forces_full_cost_run(app, db, backfill):
+    backfill(range(48))
+    generate(app)
+    generate_cost(app, rate="0.2")
+
+    response, status = generate_cost(app, rate="0.3")
+
+    assert status == 200
+    assert response["total_hours"] == 48
+    assert response["rate_used"] == pytest.approx(0.3)
+    energy = statistics(db, ENTITY_ID)
+    cost = statistics(db, COST_ENTITY_ID)
+    assert [row[1] for row in cost] == pytest.approx([row[1] * 0.3 for row in energy])
+    assert response["total_cost"] == pytest.approx(energy[-1][2] * 0.3)
+
+
+def test_orphans_past_latest_reading_are_deleted(app, db, backfill):
+    backfill(range(24))
+    generate(app)
+    generate_cost(app)
+    # Placeholder rows HA's recorder writes for hours after our latest reading
+    for statistic_id in (ENTITY_ID, COST_ENTITY_ID):
+        db.executemany("""
+            INSERT INTO statistics (metadata_id, start_ts, created_ts, state, sum)
+            SELECT id, ?, ?, 0.0, 0.0 FROM statistics_meta WHERE statistic_id = ?
+        """, [(hour_ts(hour), hour_ts(hour), statistic_id) for hour in range(24, 30)])
+    db.commit()
+
+    response, status = generate(app)
+    generate_cost(app)
+
+    assert status == 200
+    assert response["deleted"] == 6
+    assert statistics(db, ENTITY_ID)[-1][0] == hour_ts(23)
+    assert statistics(db, COST_ENTITY_ID)[-1][0] == hour_ts(23)
+
+
+def test_cost_counts_skip_hours_without_energy_state(app, db, backfill):
+    backfill(range(24))
+    generate(app)
+    generate_cost(app)
+    db.execute("""
+        UPDATE statistics SET state = NULL
+        WHERE start_ts = ? AND metadata_id = (
+            SELECT id FROM statistics_meta WHERE statistic_id = ?
+        )
+    """, (hour_ts(5), ENTITY_ID))
+    db.commit()
+
+    response, status = generate_cost(app, full_rebuild=True)
+
+    assert status == 200
+    assert response["updated"] == 23
+    assert response["inserted"] == 0
+
+
+def test_deleted_is_zero_without_orphans(app, backfill):
+    backfill(range(24))
+    generate(app)
+
+    incremental, _ = generate(app)
+    full, _ = generate(app, full_rebuild=True)
+
+    assert incremental["deleted"] == 0
+    assert full["deleted"] == 0
+
+
+def test_clear_existing_rebuilds_from_scratch(app, db, backfill):
+    backfill(range(24))
+    generate(app)
+
+    response, status = generate(app, clear_existing=True)
+
+    assert status == 200
+    assert response["inserted"] == 24
+    assert response["updated"] == 0
+    assert len(statistics(db, ENTITY_ID)) == 24
+
+
+def test_missing_statistics_metadata_is_404(app):
+    response, status = app.generate_statistics({"entity_id": "sensor.unknown"})
+
+    assert status == 404
+    assert "error" in response
+
+
+@pytest.mark.parametrize("rate", ["nan", "inf", "-0.2", "abc", [0.2]])
+def test_invalid_rate_is_rejected_before_writing(app, db, backfill, rate):
+    backfill(range(24))
+    generate(app)
+    generate_cost(app, rate="0.2")
+    before = statistics(db, COST_ENTITY_ID)
+
+    response, status = generate_cost(app, rate=rate, clear_existing=True)
+
+    assert status == 400
+    assert response == {"error": "rate must be a number"}
+    assert statistics(db, COST_ENTITY_ID) == before
+
+
+def test_failed_run_leaves_nothing_behind_for_the_next(app, db, backfill):
+    backfill(range(24))
+    db.execute("""
+        CREATE TRIGGER fail_statistics BEFORE INSERT ON statistics
+        BEGIN SELECT RAISE(ABORT, 'simulated failure'); END
+    """)
+    db.commit()
+
+    _, status = generate(app)
+    assert status == 500
+    assert statistics(db, ENTITY_ID) == []
+
+    db.execute("DROP TRIGGER fail_statistics")
+    db.commit()
+    response, status = generate(app)
+
+    assert status == 200
+    assert response["inserted"] == 24